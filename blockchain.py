@@ -1,10 +1,110 @@
 import asyncio
 import hashlib
-import json
+import multiprocessing
+import os
+import struct
 import time
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass, field
-from typing import List, Optional
-from ecdsa import SigningKey, VerifyingKey, NIST256p
+from typing import Dict, List, Optional
+import orjson
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+
+# hashlib.sha256 реализован в OpenSSL, который сам выбирает ядро при запуске: SHA-NI/AVX2/SSSE3
+# на x86 (CPUID), инструкции SHA2 ARMv8 на AArch64 (getauxval), иначе программная реализация.
+# Своя C-обёртка не нужна.
+sha256 = hashlib.sha256
+
+# Заголовок блока фиксированной ширины (little-endian):
+# index | previous_hash | timestamp | merkle_root | tx_count | pad | nonce.
+# Неизменная часть дополнена до 128 байт (два блока SHA-256), nonce лежит в байтах 128..136.
+BLOCK_HEADER = struct.Struct("<q32sd32sQ40xQ")
+NONCE = struct.Struct("<Q")
+NONCE_OFFSET = BLOCK_HEADER.size - NONCE.size
+MINE_CHUNK = 10_000
+
+MINE_WORKERS = os.cpu_count() or 1
+# fork процесса, в котором уже работают потоки (пулы ml_analysis, sklearn, asyncio), может
+# зависнуть на унаследованных блокировках — воркеры запускаются через forkserver
+MINE_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+_MINE_POOL: Optional[ProcessPoolExecutor] = None
+
+# Разные префиксы для листьев и внутренних узлов дерева Меркла (как в RFC 6962)
+MERKLE_LEAF = b"\x00"
+MERKLE_NODE = b"\x01"
+
+# ECDSA P-256 + SHA-256 через OpenSSL (cryptography); sender — открытый ключ в формате SEC1 (hex)
+SIGNATURE_ALGORITHM = ec.ECDSA(hashes.SHA256())
+_VK_CACHE: Dict[str, ec.EllipticCurvePublicKey] = {}
+
+
+def mine_range(header: bytes, nonce_start: int, difficulty: int, count: int) -> Optional[int]:
+    """Перебирает nonce из [nonce_start, nonce_start + count), возвращает первый подходящий."""
+    # difficulty нулевых hex-символов <=> хэш как 256-битное число меньше 2^(256 - 4 * difficulty)
+    target = 1 << (256 - 4 * difficulty)
+    # Midstate: часть заголовка до nonce от него не зависит, сжимаем её один раз,
+    # а на каждой попытке копируем состояние и дохэшируем только 8 байт nonce
+    midstate = sha256(header[:NONCE_OFFSET])
+    # Локальные ссылки вместо поиска глобальных имён и атрибутов на каждой итерации
+    pack_nonce, to_int = NONCE.pack, int.from_bytes
+    for nonce in range(nonce_start, nonce_start + count):
+        attempt = midstate.copy()
+        attempt.update(pack_nonce(nonce))
+        if to_int(attempt.digest(), "big") < target:
+            return nonce
+    return None
+
+
+def get_mine_pool() -> ProcessPoolExecutor:
+    """Пул майнинга; создаётся при запуске приложения (warm_up_mine_pool), а не при импорте модуля."""
+    global _MINE_POOL
+    if _MINE_POOL is None:
+        _MINE_POOL = ProcessPoolExecutor(
+            max_workers=MINE_WORKERS, mp_context=multiprocessing.get_context(MINE_START_METHOD)
+        )
+    return _MINE_POOL
+
+
+async def warm_up_mine_pool() -> None:
+    """Запускает все воркеры майнинга заранее, чтобы первый блок не ждал импорта модулей в них."""
+    loop = asyncio.get_running_loop()
+    pool = get_mine_pool()
+    # Пул поднимает процесс на каждую задачу, пока свободных воркеров нет
+    await asyncio.gather(*(loop.run_in_executor(pool, os.getpid) for _ in range(MINE_WORKERS)))
+
+
+def shutdown_mine_pool() -> None:
+    """Останавливает воркеры майнинга; следующий блок создаст пул заново."""
+    global _MINE_POOL
+    if _MINE_POOL is not None:
+        _MINE_POOL.shutdown(cancel_futures=True)
+        _MINE_POOL = None
+
+
+def merkle_root(transactions: List["Transaction"]) -> bytes:
+    """Корень дерева Меркла по хэшам транзакций (нечётный последний узел дублируется)."""
+    # Из-за дублирования [a, b, c] и [a, b, c, c] дают один корень, поэтому число транзакций
+    # отдельно входит в заголовок блока
+    level = [sha256(MERKLE_LEAF + tx.canonical_bytes()).digest() for tx in transactions]
+    if not level:
+        return bytes(32)
+    while len(level) > 1:
+        if len(level) % 2:
+            level.append(level[-1])
+        level = [sha256(MERKLE_NODE + level[i] + level[i + 1]).digest() for i in range(0, len(level), 2)]
+    return level[0]
+
+
+def get_vk(sender_hex: str) -> ec.EllipticCurvePublicKey:
+    """Открытый ключ отправителя; точка кривой разбирается один раз на процесс."""
+    vk = _VK_CACHE.get(sender_hex)
+    if vk is None:
+        vk = _VK_CACHE[sender_hex] = ec.EllipticCurvePublicKey.from_encoded_point(
+            ec.SECP256R1(), bytes.fromhex(sender_hex)
+        )
+    return vk
+
 
 @dataclass
 class Transaction:
@@ -16,20 +116,34 @@ class Transaction:
     self_consumption: float
     signature: Optional[str] = None
 
-    def sign(self, private_key: SigningKey) -> None:
-        tx_data = f"{self.sender}{self.receiver}{self.amount}".encode()
-        self.signature = private_key.sign(tx_data).hex()
+    def tx_data(self) -> bytes:
+        # Собирается при каждом вызове: поля транзакции можно менять и после подписи
+        return f"{self.sender}{self.receiver}{self.amount}".encode()
+
+    def canonical_bytes(self) -> bytes:
+        return orjson.dumps({
+            "sender": self.sender,
+            "receiver": self.receiver,
+            "amount": self.amount,
+            "input_gas": self.input_gas,
+            "output_gas": self.output_gas,
+            "self_consumption": self.self_consumption,
+            "signature": self.signature,
+        }, option=orjson.OPT_SORT_KEYS)
+
+    def sign(self, private_key: ec.EllipticCurvePrivateKey) -> None:
+        self.signature = private_key.sign(self.tx_data(), SIGNATURE_ALGORITHM).hex()
 
     def is_valid(self) -> bool:
         if self.sender == "Genesis":
             return True
         try:
-            vk = VerifyingKey.from_string(bytes.fromhex(self.sender), curve=NIST256p)
-            tx_data = f"{self.sender}{self.receiver}{self.amount}".encode()
-            return vk.verify(bytes.fromhex(self.signature), tx_data)
+            get_vk(self.sender).verify(bytes.fromhex(self.signature), self.tx_data(), SIGNATURE_ALGORITHM)
+            return True
         except Exception:
             return False
 
+
 @dataclass
 class Block:
     index: int
@@ -38,28 +152,55 @@ class Block:
     transactions: List[Transaction]
     nonce: int = 0
     hash: str = field(init=False)
+    # Заголовок фиксирует транзакции через корень Меркла, поэтому работа на nonce не зависит от их числа
+    merkle_root: bytes = field(init=False, repr=False)
 
     def __post_init__(self) -> None:
+        self.merkle_root = merkle_root(self.transactions)
         self.hash = self.calculate_hash()
 
+    def _header(self) -> bytearray:
+        return bytearray(BLOCK_HEADER.pack(
+            self.index,
+            bytes.fromhex(self.previous_hash),
+            self.timestamp,
+            self.merkle_root,
+            len(self.transactions),
+            self.nonce,
+        ))
+
     def calculate_hash(self) -> str:
-        block_data = json.dumps({
-            "index": self.index,
-            "previous_hash": self.previous_hash,
-            "timestamp": self.timestamp,
-            "nonce": self.nonce,
-        }, sort_keys=True)
-        return hashlib.sha256(block_data.encode()).hexdigest()
+        return sha256(self._header()).hexdigest()
 
     async def mine(self, difficulty: int) -> None:
-        while not self.hash.startswith("0" * difficulty):
-            self.nonce += 1
-            self.hash = self.calculate_hash()
-            await asyncio.sleep(0)
+        # Каждый воркер пула перебирает свой непересекающийся диапазон nonce;
+        # цикл событий свободен, пока хэширование идёт в других процессах
+        loop = asyncio.get_running_loop()
+        pool = get_mine_pool()
+        header = bytes(self._header())
+        start = self.nonce
+        nonce = None
+        while nonce is None:
+            pending = {
+                loop.run_in_executor(pool, mine_range, header, start + k * MINE_CHUNK, difficulty, MINE_CHUNK)
+                for k in range(MINE_WORKERS)
+            }
+            start += MINE_WORKERS * MINE_CHUNK
+            while pending and nonce is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                found = [future.result() for future in done if future.result() is not None]
+                if found:
+                    nonce = min(found)
+            for future in pending:
+                future.cancel()
+        self.nonce = nonce
+        self.hash = self.calculate_hash()
 
 class Blockchain:
     def __init__(self, difficulty: int = 4):
-        self.chain = [self._create_genesis_block()]
+        genesis = self._create_genesis_block()
+        self.chain = [genesis]
+        self._by_hash: Dict[str, Block] = {genesis.hash: genesis}
         self.difficulty = difficulty
         self.pending_transactions: List[Transaction] = []
 
@@ -72,29 +213,43 @@ class Blockchain:
             output_gas=0,
             self_consumption=0
         )
-        return Block(0, "0", time.time(), [genesis_tx])
+        return Block(0, "0" * 64, time.time(), [genesis_tx])
 
     async def add_block(self) -> Block:
         if not self.pending_transactions:
             raise ValueError("Нет транзакций для добавления!")
 
+        transactions, self.pending_transactions = self.pending_transactions, []
         latest_block = self.chain[-1]
         new_block = Block(
             index=latest_block.index + 1,
             previous_hash=latest_block.hash,
             timestamp=time.time(),
-            transactions=self.pending_transactions.copy(),
+            transactions=transactions,
         )
 
-        await new_block.mine(self.difficulty)
+        try:
+            await new_block.mine(self.difficulty)
+        except BaseException:
+            # Майнинг не удался или запрос отменён — транзакции возвращаются в очередь перед новыми
+            self.pending_transactions = transactions + self.pending_transactions
+            raise
         self.chain.append(new_block)
-        self.pending_transactions.clear()
+        self._by_hash[new_block.hash] = new_block
         return new_block
 
+    def get_block_by_hash(self, block_hash: str) -> Optional[Block]:
+        return self._by_hash.get(block_hash)
+
     def is_valid(self) -> bool:
-        for i in range(1, len(self.chain)):
-            current = self.chain[i]
-            previous = self.chain[i - 1]
-            if current.hash != current.calculate_hash() or current.previous_hash != previous.hash:
+        # Корень Меркла и хэш пересчитываются из самих блоков, так что правка транзакций или nonce видна
+        previous_hash = self.chain[0].previous_hash
+        for block in self.chain:
+            if (
+                block.previous_hash != previous_hash
+                or block.merkle_root != merkle_root(block.transactions)
+                or block.hash != block.calculate_hash()
+            ):
                 return False
-        return True
\ No newline at end of file
+            previous_hash = block.hash
+        return True
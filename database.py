@@ -1,7 +1,8 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, func
+from sqlalchemy import create_engine, insert, Column, Integer, String, DateTime, func
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from typing import List
 
 DATABASE_URL = "postgresql+asyncpg://postgres:postgres@db:5432/gas_db"
 engine = create_async_engine(DATABASE_URL)
@@ -19,3 +20,9 @@ async def get_db():
     async with AsyncSessionLocal() as db:
         yield db
 
+
+async def insert_block_refs(block_hashes: List[str]) -> None:
+    """Записывает пачку хэшей блоков одним многострочным INSERT."""
+    async with AsyncSessionLocal() as db:
+        await db.execute(insert(BlockReference), [{"block_hash": block_hash} for block_hash in block_hashes])
+        await db.commit()
@@ -3,12 +3,14 @@ from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel, ValidationError
 from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
 from fastapi import Request, Response
+from fastapi.responses import ORJSONResponse
 from starlette.middleware.base import BaseHTTPMiddleware
-from sqlalchemy.ext.asyncio import AsyncSession
-from database import BlockReference, get_db
-from ml_analysis import detect_anomaly
-from blockchain import Blockchain, Transaction as BlockchainTransaction
+from database import insert_block_refs
+from ml_analysis import detect_anomaly, warm_up
+from blockchain import Blockchain, Transaction as BlockchainTransaction, shutdown_mine_pool, warm_up_mine_pool
 from collections import defaultdict
+from contextlib import asynccontextmanager, suppress
+import hmac
 import os
 import logging
 import asyncio
@@ -17,12 +19,61 @@ from typing import List
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Пакетная запись хэшей блоков в БД
+FLUSH_INTERVAL = 0.02  # сек
+FLUSH_BATCH = 100
+_PENDING_REFS: List[str] = []
+_flush_needed = asyncio.Event()
+_flush_task = None
+
+
+async def flush_block_refs():
+    global _PENDING_REFS
+    if not _PENDING_REFS:
+        return
+    refs, _PENDING_REFS = _PENDING_REFS, []
+    try:
+        await insert_block_refs(refs)
+    except Exception as e:
+        # Возвращаем пачку в начало очереди, следующая попытка запишет её вместе с новыми хэшами
+        _PENDING_REFS = refs + _PENDING_REFS
+        logging.critical(f"Failed to save {len(refs)} block references: {str(e)}")
+
+
+async def block_ref_flusher():
+    global _flush_task
+    while True:
+        with suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(_flush_needed.wait(), FLUSH_INTERVAL)
+        _flush_needed.clear()
+        # shield: отмена flusher при остановке не прерывает запись, которая уже идёт
+        _flush_task = asyncio.ensure_future(flush_block_refs())
+        await asyncio.shield(_flush_task)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await warm_up()  # модель загружается до первого запроса, а не во время него
+    await warm_up_mine_pool()
+    flusher = asyncio.create_task(block_ref_flusher())
+    yield
+    flusher.cancel()
+    with suppress(asyncio.CancelledError):
+        await flusher
+    if _flush_task is not None:
+        await _flush_task  # дожидаемся записи, начатой до отмены flusher
+    await flush_block_refs()  # дописываем остаток очереди перед остановкой
+    await asyncio.to_thread(shutdown_mine_pool)
+
+
 app = FastAPI(
     title="Gas Balance Blockchain API",
     description="API для учета газового баланса с использованием блокчейна",
     version="1.0",
     docs_url="/docs",
     redoc_url="/redoc",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
 )
 
 # Инициализация блокчейна
@@ -49,7 +100,8 @@ app.add_middleware(MetricsMiddleware)
 
 
 async def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    if not credentials or credentials.credentials != API_TOKEN:
+    # compare_digest принимает str только из ASCII — сравниваем байты, иначе не-ASCII токен дал бы 500
+    if not credentials or not hmac.compare_digest(credentials.credentials.encode(), API_TOKEN.encode()):
         raise HTTPException(status_code=401, detail="Invalid API Token")
 
 
@@ -68,7 +120,7 @@ async def get_metrics():
 
 
 @app.post("/transactions/", dependencies=[Depends(verify_token)], tags=["Transactions"])
-async def add_transaction(transaction: APITransaction, db: AsyncSession = Depends(get_db)):
+async def add_transaction(transaction: APITransaction):
     try:
         logging.info(f"Received transaction: {transaction}")
 
@@ -88,10 +140,10 @@ async def add_transaction(transaction: APITransaction, db: AsyncSession = Depend
         # Майним блок с накопленными транзакциями
         new_block = await blockchain.add_block()
 
-        # Записываем в базу данных
-        block_ref = BlockReference(block_hash=new_block.hash)
-        db.add(block_ref)
-        await db.commit()
+        # Ставим хэш в очередь на запись в базу данных; flusher пишет их пачками
+        _PENDING_REFS.append(new_block.hash)
+        if len(_PENDING_REFS) >= FLUSH_BATCH:
+            _flush_needed.set()
 
         logging.info(f"New block created: {new_block.hash}")
 
@@ -116,27 +168,21 @@ async def get_blockchain():
 )
 async def get_block(block_hash: str):
     try:
-        block = next((b for b in blockchain.chain if b.hash == block_hash), None)
+        block = blockchain.get_block_by_hash(block_hash)
         if not block:
             raise HTTPException(status_code=404, detail="Block not found")
 
         logging.info(f"Fetching block: {block_hash}")
 
-        # Логируем все транзакции в блоке
-        for tx in block.transactions:
-            logging.info(
-                f"TX: sender={tx.sender}, input={getattr(tx, 'input_gas', 0)}, "
-                f"output={getattr(tx, 'output_gas', 0)}, "
-                f"self={getattr(tx, 'self_consumption', 0)}")
-
         # Агрегируем данные по station_id
         station_data = defaultdict(lambda: {"input_gas": 0, "output_gas": 0, "self_consumption": 0})
         for tx in block.transactions:
-            station_data[tx.sender]["input_gas"] += getattr(tx, "input_gas", 0)
-            station_data[tx.sender]["output_gas"] += getattr(tx, "output_gas", 0)
-            station_data[tx.sender]["self_consumption"] += getattr(tx, "self_consumption", 0)
+            totals = station_data[tx.sender]
+            totals["input_gas"] += tx.input_gas
+            totals["output_gas"] += tx.output_gas
+            totals["self_consumption"] += tx.self_consumption
 
-        logging.info(f"Aggregated transactions: {station_data}")
+        logging.info(f"Aggregated transactions: {dict(station_data)}")
 
         return {
             "index": block.index,
@@ -145,7 +191,8 @@ async def get_block(block_hash: str):
                 {"station_id": station, **data} for station, data in station_data.items()
             ],
             "hash": block.hash,
-            "previous_hash": block.previous_hash
+            "previous_hash": block.previous_hash,
+            "merkle_root": block.merkle_root.hex()
         }
     except Exception as e:
         logging.critical(f"Error fetching block: {str(e)}")
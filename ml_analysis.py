@@ -1,96 +1,326 @@
 import numpy as np
 import joblib
 import os
-import pandas as pd
+import pickle
 import asyncio
-from fastapi import FastAPI, Depends
-from pydantic import BaseModel
-from sklearn.ensemble import IsolationForest
-
-app = FastAPI()
+import tempfile
+import xxhash
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from functools import partial
 
 MODEL_PATH = "anomaly_model.pkl"
-DATA_PATH = "gas_data.csv"
-
+DATA_PATH = "gas_data.npy"
 
-async def generate_realistic_data():
-    """Асинхронное создание и сохранение синтетических данных."""
-    normal_data = []
-    anomalies = []
+BATCH_SIZE = 128  # максимум образцов в одном вызове predict
+BATCH_WAIT = 0.005  # сколько ждать (сек) конкурентные запросы перед predict
+INLINE_BATCH = 8  # пачки до этого размера считаются прямо в цикле событий, без перехода в поток
+CACHE_SIZE = 8192  # LRU-кэш результатов по квантованным входным данным
+CACHE_DIGITS = 1  # до скольких знаков округляются входные данные в ключе кэша
 
-    for _ in range(500):  # Нормальные случаи
-        input_gas = np.random.uniform(5000, 10000)
-        output_gas = input_gas * np.random.uniform(0.97, 0.99)  # Потери 1-3%
-        self_consumption = np.random.uniform(50, 200)
-        normal_data.append([input_gas, output_gas, self_consumption, 0])  # 0 = нормальное состояние
+_MODEL_CACHE = None
+_MODEL_VERSION = 0  # входит в ключ кэша результатов; растёт при каждом переобучении
+_MODEL_LOCK = asyncio.Lock()
+_LOAD_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-load")
+# Свой поток для инференса: всплеск запросов не отнимает общий пул asyncio.to_thread у файлового I/O.
+# Воркер пакетов ждёт каждую пачку, поэтому одновременно выполняется не больше одного predict
+_INFER_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="infer")
 
-    for _ in range(10):  # Аномалии
-        anomaly_type = np.random.choice(["low_output", "high_self_consumption", "negative_balance"])
+_queue = None
+_batch_full = None
+_worker = None
+_cache = OrderedDict()
 
-        if anomaly_type == "low_output":
-            input_gas = np.random.uniform(5000, 10000)
-            output_gas = input_gas * np.random.uniform(0.5, 0.8)  # Слишком большие потери
-            self_consumption = np.random.uniform(50, 200)
 
-        elif anomaly_type == "high_self_consumption":
-            input_gas = np.random.uniform(5000, 10000)
-            output_gas = input_gas * np.random.uniform(0.97, 0.99)
-            self_consumption = np.random.uniform(1000, 3000)  # Чрезмерный расход
+async def generate_realistic_data():
+    """Асинхронное создание и сохранение синтетических данных."""
+    rng = np.random.default_rng()
+    n_normal, n_anomalies = 500, 10
+    n = n_normal + n_anomalies
 
-        else:  # negative_balance
-            input_gas = np.random.uniform(5000, 10000)
-            output_gas = input_gas * np.random.uniform(1.01, 1.05)  # Ошибка учета
-            self_consumption = np.random.uniform(50, 200)
+    # Колонки: input_gas, output_gas, self_consumption, is_anomaly.
+    # order="F" — каждая колонка лежит непрерывно (SoA) и заполняется на месте,
+    # без промежуточных column_stack/concatenate
+    data = np.empty((n, 4), order="F")
+    input_gas, output_gas, self_consumption, is_anomaly = data.T
 
-        anomalies.append([input_gas, output_gas, self_consumption, 1])  # 1 = аномалия
+    # Нормальные случаи: потери 1-3%
+    input_gas[:] = rng.uniform(5000, 10000, n)
+    output_ratio = rng.uniform(0.97, 0.99, n)
+    self_consumption[:] = rng.uniform(50, 200, n)
+    is_anomaly[:n_normal] = 0  # 0 = нормальное состояние
+    is_anomaly[n_normal:] = 1  # 1 = аномалия
 
-    data = normal_data + anomalies
+    # Аномалии: 0 = low_output, 1 = high_self_consumption, 2 = negative_balance
+    anomaly_type = np.full(n, -1)
+    anomaly_type[n_normal:] = rng.integers(0, 3, n_anomalies)
+    low_output = anomaly_type == 0
+    high_self_consumption = anomaly_type == 1
+    negative_balance = anomaly_type == 2
 
-    df = pd.DataFrame(data, columns=["input_gas", "output_gas", "self_consumption", "is_anomaly"])
+    output_ratio[low_output] = rng.uniform(0.5, 0.8, low_output.sum())  # Слишком большие потери
+    output_ratio[negative_balance] = rng.uniform(1.01, 1.05, negative_balance.sum())  # Ошибка учета
+    self_consumption[high_self_consumption] = rng.uniform(1000, 3000, high_self_consumption.sum())  # Чрезмерный расход
+    np.multiply(input_gas, output_ratio, out=output_gas)
 
-    # Асинхронная запись в CSV
-    await asyncio.to_thread(df.to_csv, DATA_PATH, index=False)
+    # Асинхронная запись в бинарный .npy, без преобразования чисел в текст
+    await asyncio.to_thread(np.save, DATA_PATH, data)
     print(f"✅ Данные сохранены в {DATA_PATH}")
 
 
 async def load_data():
-    """Асинхронная загрузка данных из CSV."""
+    """Асинхронная загрузка данных из .npy."""
     if not os.path.exists(DATA_PATH):
         print("⚠️ Данных нет, создаем тестовый датасет...")
         await generate_realistic_data()
 
-    df = await asyncio.to_thread(pd.read_csv, DATA_PATH)
-    return df[["input_gas", "output_gas", "self_consumption"]].values
+    # mmap вместо чтения в память: колонки типизированы, копия создается только при обучении
+    data = await asyncio.to_thread(np.load, DATA_PATH, mmap_mode="r")
+    return data[:, :3]  # input_gas, output_gas, self_consumption
 
 
 async def train_model():
     """Асинхронное обучение модели и сохранение в файл."""
-    data = await load_data()
-    model = IsolationForest(contamination=0.02, random_state=42)
+    from sklearn.ensemble import IsolationForest  # тяжёлый импорт нужен только при обучении
+
+    # sklearn строит деревья на float32 — приводим заранее, без внутренней копии при fit
+    data = np.ascontiguousarray(await load_data(), dtype=np.float32)
+    data_hash = _data_hash(data)
+    # max_samples=256 ограничивает глубину деревьев (<= 8), весь лес остаётся в кэше CPU
+    model = IsolationForest(
+        n_estimators=100, max_samples=256, contamination=0.02, random_state=42, n_jobs=-1
+    )
 
     await asyncio.to_thread(model.fit, data)
-    await asyncio.to_thread(joblib.dump, model, MODEL_PATH)
+    # Рядом с моделью сохраняем плоские массивы её деревьев, по которым идёт predict_anomaly
+    # data_hash — по нему при загрузке видно, на тех ли данных обучена модель
+    artifact = {
+        "model": model,
+        "forest": await asyncio.to_thread(flatten_forest, model),
+        "data_hash": data_hash,
+    }
+    await asyncio.to_thread(_dump_artifact, artifact)
+    invalidate_model_cache()
 
     print(f"✅ Модель обучена и сохранена в {MODEL_PATH}")
 
 
+def _dump_artifact(artifact):
+    """Пишет артефакт во временный файл рядом с MODEL_PATH и атомарно подменяет им старый."""
+    # Старый файл может быть отображён в память (mmap_mode="r") этим или другим воркером:
+    # os.replace оставляет им прежний inode, а перезапись на месте испортила бы их страницы
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(MODEL_PATH)), suffix=".tmp")
+    os.close(fd)
+    try:
+        # Без сжатия, чтобы массивы модели можно было отобразить в память при загрузке
+        joblib.dump(artifact, tmp_path, compress=0, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, MODEL_PATH)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _data_hash(data):
+    """Хэш обучающих данных в том виде, в котором они идут в fit."""
+    # xxh3 упирается только в пропускную способность памяти, проверка не растёт заметно с датасетом
+    return xxhash.xxh3_128(np.ascontiguousarray(data, dtype=np.float32)).hexdigest()
+
+
+async def _current_data_hash():
+    return _data_hash(await load_data())
+
+
+async def _read_artifact():
+    # Отдельный поток, чтобы чтение модели не занимало общий пул asyncio.to_thread
+    return await asyncio.get_running_loop().run_in_executor(
+        _LOAD_POOL, partial(joblib.load, MODEL_PATH, mmap_mode="r")
+    )
+
+
+async def _load_artifact():
+    """Модель и её плоские деревья; с диска читаются один раз, дальше берутся из памяти."""
+    global _MODEL_CACHE
+    # Быстрый путь без блокировки: после первой загрузки запросы не ждут друг друга на lock
+    artifact = _MODEL_CACHE
+    if artifact is not None:
+        return artifact
+
+    async with _MODEL_LOCK:
+        if _MODEL_CACHE is not None:  # модель успели загрузить, пока ждали блокировку
+            return _MODEL_CACHE
+        if not os.path.exists(MODEL_PATH):
+            await train_model()  # Если модели нет – обучаем
+        artifact = await _read_artifact()
+        # Файл старого формата или модель обучена на других данных — переобучаем
+        if not isinstance(artifact, dict) or artifact.get("data_hash") != await _current_data_hash():
+            await train_model()
+            artifact = await _read_artifact()
+        _MODEL_CACHE = artifact
+        return artifact
+
+
 async def load_model():
     """Асинхронная загрузка модели."""
-    if not os.path.exists(MODEL_PATH):
-        await train_model()  # Если модели нет – обучаем
+    return (await _load_artifact())["model"]
+
+
+async def load_forest():
+    """Асинхронная загрузка плоских массивов деревьев для predict_anomaly."""
+    return (await _load_artifact())["forest"]
+
 
-    return await asyncio.to_thread(joblib.load, MODEL_PATH)
+def invalidate_model_cache():
+    """Сбрасывает закэшированную модель, следующий load_model перечитает файл."""
+    global _MODEL_CACHE, _MODEL_VERSION
+    _MODEL_CACHE = None
+    _MODEL_VERSION += 1  # результаты старой модели больше не совпадут ни с одним ключом
+
+
+def _average_path_length(n_samples):
+    """Средняя длина пути в дереве из n_samples точек (нормировка из статьи об Isolation Forest)."""
+    n = np.asarray(n_samples, dtype=np.float64)
+    result = np.zeros_like(n)
+    result[n == 2] = 1.0
+    mask = n > 2
+    result[mask] = 2.0 * (np.log(n[mask] - 1.0) + np.euler_gamma) - 2.0 * (n[mask] - 1.0) / n[mask]
+    return result
+
+
+def flatten_forest(model):
+    """Упаковывает деревья обученного IsolationForest в плоские массивы [дерево, узел]."""
+    trees = [estimator.tree_ for estimator in model.estimators_]
+    shape = (len(trees), max(tree.node_count for tree in trees))
+    features = np.zeros(shape, dtype=np.int32)
+    thresholds = np.zeros(shape, dtype=np.float32)
+    left = np.zeros(shape, dtype=np.int32)
+    right = np.zeros(shape, dtype=np.int32)
+    path_lengths = np.zeros(shape, dtype=np.float64)
+    subsample_features = model._max_features != model.n_features_in_
+
+    for t, (tree, tree_features) in enumerate(zip(trees, model.estimators_features_)):
+        count = tree.node_count
+        nodes = np.arange(count)
+        leaf = tree.children_left[:count] == -1
+        feature = np.where(leaf, 0, tree.feature[:count])
+        # Листья ссылаются сами на себя, чтобы обход всех деревьев шёл фиксированное число шагов
+        features[t, :count] = tree_features[feature] if subsample_features else feature
+        # Пороги храним в float32 (вдвое меньше памяти на обход), округляя вниз:
+        # для float32-признака x <= t  <=>  x <= наибольшего float32, не превосходящего t
+        threshold = tree.threshold[:count].astype(np.float32)
+        rounded_up = threshold > tree.threshold[:count]
+        threshold[rounded_up] = np.nextafter(threshold[rounded_up], np.float32(-np.inf))
+        thresholds[t, :count] = threshold
+        left[t, :count] = np.where(leaf, nodes, tree.children_left[:count])
+        right[t, :count] = np.where(leaf, nodes, tree.children_right[:count])
+        # Длина пути до листа заранее: глубина листа + поправка на число точек в нём
+        depth = np.zeros(count)
+        for node in np.flatnonzero(~leaf):  # дети всегда нумеруются после родителя
+            depth[tree.children_left[node]] = depth[tree.children_right[node]] = depth[node] + 1
+        path_lengths[t, :count] = depth + _average_path_length(tree.n_node_samples[:count])
+
+    return {
+        "features": features,
+        "thresholds": thresholds,
+        "left": left,
+        "right": right,
+        "path_lengths": path_lengths,
+        "max_depth": max(tree.max_depth for tree in trees),
+        "denominator": len(trees) * _average_path_length([model.max_samples_])[0],
+        "offset": model.offset_,
+    }
+
+
+def predict_anomaly(data, forest):
+    """Векторизованный аналог IsolationForest.predict(data) == -1 по плоским массивам."""
+    data = np.asarray(data, dtype=np.float32)  # sklearn сравнивает признаки в float32
+    trees = np.arange(forest["features"].shape[0])
+    rows = np.arange(data.shape[0])[:, None]
+    nodes = np.zeros((data.shape[0], trees.size), dtype=np.int32)
+
+    for _ in range(forest["max_depth"]):
+        go_left = data[rows, forest["features"][trees, nodes]] <= forest["thresholds"][trees, nodes]
+        nodes = np.where(go_left, forest["left"][trees, nodes], forest["right"][trees, nodes])
+
+    depths = forest["path_lengths"][trees, nodes].sum(axis=1)
+    scores = -(2.0 ** (-depths / forest["denominator"]))
+    return scores - forest["offset"] < 0
+
+
+async def warm_up():
+    """Загружает (при необходимости обучает) модель и прогоняет пробный образец до приёма запросов."""
+    forest = await load_forest()
+    predict_anomaly(np.zeros((1, 3), dtype=np.float32), forest)  # подтягивает страницы mmap
+
+
+def _ensure_batch_worker():
+    """Лениво запускает фоновую задачу пакетной обработки в текущем цикле событий."""
+    global _queue, _batch_full, _worker
+    if _worker is None or _worker.done():
+        _queue = asyncio.Queue()
+        _batch_full = asyncio.Event()
+        _worker = asyncio.create_task(_batch_worker(_queue, _batch_full))
+
+
+async def _batch_worker(queue, batch_full):
+    """Собирает конкурентные запросы в пачки и прогоняет их через модель одним predict."""
+    # Переиспользуется между пачками; float32 — тот же тип, в котором идёт сравнение с порогами деревьев
+    buffer = np.empty((BATCH_SIZE, 3), dtype=np.float32)
+    while True:
+        batch = [await queue.get()]
+        # Ждём конкурентные запросы не дольше BATCH_WAIT; полная пачка уходит в predict сразу
+        if queue.qsize() + 1 < BATCH_SIZE:
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(batch_full.wait(), BATCH_WAIT)
+        batch_full.clear()
+        while len(batch) < BATCH_SIZE and not queue.empty():
+            batch.append(queue.get_nowait())
+
+        try:
+            forest = await load_forest()
+            for row, (input_data, _) in enumerate(batch):
+                buffer[row] = input_data
+            if len(batch) <= INLINE_BATCH:
+                # Обход плоского леса для нескольких образцов занимает десятки микросекунд —
+                # дешевле посчитать сразу, чем платить за передачу задачи в поток
+                result = predict_anomaly(buffer[:len(batch)], forest)
+            else:
+                result = await asyncio.get_running_loop().run_in_executor(
+                    _INFER_POOL, predict_anomaly, buffer[:len(batch)], forest
+                )
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            continue
+
+        for (_, future), is_anomaly in zip(batch, result):
+            if not future.done():
+                future.set_result(bool(is_anomaly))
 
 
 async def detect_anomaly(input_data):
     """Асинхронная проверка данных на аномалии."""
-    model = await load_model()
-    data = np.array([input_data])
-    result = await asyncio.to_thread(model.predict, data)  # -1 = аномалия, 1 = нормально
-    return bool(result[0] == -1)
+    key = (_MODEL_VERSION, *(round(float(value), CACHE_DIGITS) for value in input_data))
+    if key in _cache:
+        _cache.move_to_end(key)
+        return _cache[key]
+
+    _ensure_batch_worker()
+    future = asyncio.get_running_loop().create_future()
+    await _queue.put((input_data, future))
+    if _queue.qsize() >= BATCH_SIZE:
+        _batch_full.set()
+    result = await future
+
+    _cache[key] = result
+    if len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+    return result
 
 
 async def verify_token():
     """Фиктивная проверка токена (замени на реальную логику)."""
-    await asyncio.sleep(0.1)  # Симуляция проверки
+    # Без искусственной задержки: async def FastAPI вызывает прямо в цикле событий,
+    # а обычный def отправил бы в пул потоков
     return True
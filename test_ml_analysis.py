@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from sklearn.ensemble import IsolationForest
+
+from ml_analysis import flatten_forest, predict_anomaly
+
+
+def _fit(max_features):
+    rng = np.random.default_rng(0)
+    train = rng.normal(size=(300, 3)) * [1000, 1000, 50] + [7500, 7300, 120]
+    model = IsolationForest(
+        n_estimators=50, max_samples=128, max_features=max_features, contamination=0.05, random_state=0
+    ).fit(train)
+    return model, train, rng
+
+
+@pytest.mark.parametrize("max_features", [1.0, 2])
+def test_predict_anomaly_matches_sklearn(max_features):
+    model, train, rng = _fit(max_features)
+    data = np.vstack([train, rng.uniform(train.min(axis=0) - 500, train.max(axis=0) + 500, (2000, 3))])
+
+    np.testing.assert_array_equal(predict_anomaly(data, flatten_forest(model)), model.predict(data) == -1)
+
+
+@pytest.mark.parametrize("max_features", [1.0, 2])
+def test_predict_anomaly_on_float32_thresholds(max_features):
+    # Признак ставится ровно на порог узла и на соседние float32 — здесь важно округление порогов вниз
+    model, train, _ = _fit(max_features)
+    rows = []
+    for estimator, features in zip(model.estimators_, model.estimators_features_):
+        tree = estimator.tree_
+        for node in np.flatnonzero(tree.children_left != -1):
+            feature = features[tree.feature[node]]
+            threshold = tree.threshold[node]
+            nearest = np.float32(threshold)
+            for value in (threshold, nearest, np.nextafter(nearest, np.float32(-np.inf)),
+                          np.nextafter(nearest, np.float32(np.inf))):
+                row = train[len(rows) % len(train)].copy()
+                row[feature] = value
+                rows.append(row)
+    data = np.array(rows)
+
+    np.testing.assert_array_equal(predict_anomaly(data, flatten_forest(model)), model.predict(data) == -1)